@@ -15,17 +15,14 @@
 
 from __future__ import unicode_literals, absolute_import
 
-from contextlib import contextmanager
-from email.encoders import encode_noop
-from email.mime.application import MIMEApplication
-
-import six
+import os
+import re
+import time
 
-from six.moves.email_mime_base import MIMEBase
-from six.moves.email_mime_multipart import MIMEMultipart
-from six.moves.email_mime_text import MIMEText
-from six.moves.urllib.parse import urlencode
-from six.moves.urllib.request import urlopen
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from threading import Lock
 
 # Constants
 VALIDITY_UNKNOWN = 0
@@ -34,6 +31,39 @@ VALIDITY_MARGINAL = 2
 VALIDITY_FULL = 3
 VALIDITY_ULTIMATE = 4
 
+#: Maximum number of keys kept in memory by :py:meth:`GpgBackendBase.fetch_key`.
+KEY_CACHE_SIZE = 1024
+
+#: Maximum size in bytes of a response from a keyserver accepted by
+#: :py:meth:`GpgBackendBase.fetch_key`.
+KEY_MAX_SIZE = 4 << 20
+
+#: Number of seconds a key fetched by :py:meth:`GpgBackendBase.fetch_key` is kept in memory.
+KEY_CACHE_TIMEOUT = 3600
+
+#: Maximum number of threads used by :py:meth:`GpgBackendBase.encrypt_messages` by default.
+#: Operations with private keys are serialized by gpg-agent, so more threads usually do not
+#: increase throughput any further.
+ENCRYPT_MESSAGES_MAX_WORKERS = 4
+
+# URL used by fetch_key(), only the keyserver and the (quoted) search string vary
+_hkp_lookup_url = '%s/pks/lookup?search=%s&options=mr&op=get'
+
+# Process-wide cache of fetched keys, mapping (keyserver, search) to (timestamp, key)
+_key_cache = OrderedDict()
+_key_cache_lock = Lock()
+
+# Matches newlines that are not already preceded by a carriage return
+_lone_lf_re = re.compile(br'(?<!\r)\n')
+
+
+def _normalize_crlf(data):
+    """Replace newlines (``\\n``) that are not preceded by a carriage return with ``\\r\\n``."""
+    if b'\r' not in data:
+        return data.replace(b'\n', b'\r\n')
+    return _lone_lf_re.sub(b'\r\n', data)
+
+
 class GpgMimeError(Exception):
     """Base class for all exceptions."""
 
@@ -76,15 +106,22 @@ class GpgBackendBase(object):
         self._path = path
         self._default_trust = default_trust
 
-    def fetch_key(self, search, keyserver='http://pool.sks-keyservers.net:11371', **kwargs):
+    def fetch_key(self, search, keyserver='http://pool.sks-keyservers.net:11371', cache=True,
+                  **kwargs):
         """Fetch a key from the given keyserver.
 
+        Fetched keys are kept in a process-wide cache for :py:data:`KEY_CACHE_TIMEOUT` seconds, so
+        repeatedly fetching the same key does not query the keyserver again.
+
         Parameters
         ----------
         search : str
             The search string. If this is a fingerprint, it must start with ``"0x"``.
         keyserver : str, optional
             URL of the keyserver, the default is ``"http://pool.sks-keyservers.net:11371"``.
+        cache : bool, optional
+            Set to ``False`` to bypass the cache and always query the keyserver. The fetched key
+            will still be stored in the cache.
         **kwargs
             All kwargs are passed to :py:func:`urllib.request.urlopen`. The ``timeout`` parameter
             defaults to three seconds this function (``urlopen`` is a blocking function and thus
@@ -103,16 +140,75 @@ class GpgBackendBase(object):
             If the keyserver cannot be reached.
         urllib.error.HTTPError
             If the keyserver does not respond with http 200, e.g. if the key is not found.
+        GpgMimeError
+            If the response is larger than :py:data:`KEY_MAX_SIZE`.
         """
+        from urllib.parse import quote_plus
+        from urllib.request import urlopen
+
+        cache_key = (keyserver, search)
+        now = time.time()
+
+        if cache is True:
+            with _key_cache_lock:
+                cached = _key_cache.get(cache_key)
+                if cached is not None and cached[0] > now - KEY_CACHE_TIMEOUT:
+                    _key_cache.move_to_end(cache_key)
+                    return cached[1]
+
         kwargs.setdefault('timeout', 3)
-        params = {
-            'search': search,
-            'options': 'mr',
-            'op': 'get',
-        }
-        url = '%s/pks/lookup?%s' % (keyserver, urlencode(params))
-        response = urlopen(url, **kwargs)
-        return response.read().strip()
+        url = _hkp_lookup_url % (keyserver, quote_plus(search, safe=''))
+        with urlopen(url, **kwargs) as response:
+            key = response.read(KEY_MAX_SIZE + 1)
+        if len(key) > KEY_MAX_SIZE:
+            raise GpgMimeError("Keyserver response exceeds %s bytes." % KEY_MAX_SIZE)
+        key = key.strip()
+
+        with _key_cache_lock:
+            _key_cache[cache_key] = (now, key)
+            _key_cache.move_to_end(cache_key)
+            while len(_key_cache) > KEY_CACHE_SIZE:
+                _key_cache.popitem(last=False)
+
+        return key
+
+    def fetch_keys(self, searches, keyserver='http://pool.sks-keyservers.net:11371',
+                   max_workers=8, **kwargs):
+        """Fetch multiple keys from the given keyserver in parallel.
+
+        This function calls :py:func:`fetch_key` for every search string using a pool of threads,
+        so that the network latency of the individual requests overlaps.
+
+        Parameters
+        ----------
+        searches : list of str
+            The search strings, see :py:func:`fetch_key`.
+        keyserver : str, optional
+            URL of the keyserver, the default is ``"http://pool.sks-keyservers.net:11371"``.
+        max_workers : int, optional
+            Maximum number of concurrent requests, the default is ``8``.
+        **kwargs
+            All kwargs are passed to :py:func:`fetch_key`.
+
+        Returns
+        -------
+
+        keys : list of bytes
+            The requested keys, in the same order as ``searches``.
+
+        Raises
+        ------
+
+        urllib.error.URLError
+            If the keyserver cannot be reached.
+        urllib.error.HTTPError
+            If the keyserver does not respond with http 200, e.g. if a key is not found.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        fetch = partial(self.fetch_key, keyserver=keyserver, **kwargs)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(fetch, searches))
 
     def get_settings(self):
         return {
@@ -125,7 +221,19 @@ class GpgBackendBase(object):
     def settings(self, **kwargs):
         my_settings = self.get_settings()
         my_settings.update(kwargs)
-        yield self.__class__(**my_settings)
+        backend = self.__class__(**my_settings)
+        try:
+            yield backend
+        finally:
+            backend.close()
+
+    def close(self):
+        """Release any resources held by this backend in the current thread.
+
+        The backend can still be used afterwards, resources will be acquired again as needed. The
+        default implementation does nothing.
+        """
+        pass
 
     ##############
     # Encrypting #
@@ -133,8 +241,10 @@ class GpgBackendBase(object):
 
     def get_control_message(self):
         """Get a control message for encrypted messages, as descripted in RFC 3156, chapter 4."""
+        from email.mime.base import MIMEBase
 
-        msg = MIMEApplication(_data='Version: 1\n', _subtype='pgp-encrypted', _encoder=encode_noop)
+        msg = MIMEBase(_maintype='application', _subtype='pgp-encrypted')
+        msg.set_payload('Version: 1\n')
         msg.add_header('Content-Description', 'PGP/MIME version identification')
         return msg
 
@@ -147,6 +257,7 @@ class GpgBackendBase(object):
         message : MIMEBase
             The message to encrypt (e.g. as created by :py:func:`get_octed_stream`.
         """
+        from email.mime.multipart import MIMEMultipart
 
         control = self.get_control_message()
         msg = MIMEMultipart(_subtype='encrypted', _subparts=[control, message])
@@ -159,13 +270,18 @@ class GpgBackendBase(object):
         This function returns the encrypted payload message. The parameters are the same as in
         :py:func:`encrypt_message`.
         """
+        from email.mime.base import MIMEBase
+
+        data = message.as_bytes()
         if signer is None:
-            encrypted = self.encrypt(message.as_bytes(), recipients, **kwargs)
+            encrypted = self.encrypt(data, recipients, **kwargs)
         else:
-            encrypted = self.sign_encrypt(message.as_bytes(), recipients, signer, **kwargs)
+            encrypted = self.sign_encrypt(data, recipients, signer, **kwargs)
 
-        msg = MIMEApplication(_data=encrypted, _subtype='octet-stream', name='encrypted.asc',
-                              _encoder=encode_noop)
+        # ASCII-armored data is 7bit-safe, so no further encoding is necessary
+        msg = MIMEBase(_maintype='application', _subtype='octet-stream', name='encrypted.asc')
+        msg.set_payload(encrypted)
+        msg.add_header('Content-Transfer-Encoding', '7bit')
         msg.add_header('Content-Description', 'OpenPGP encrypted message')
         msg.add_header('Content-Disposition', 'inline; filename="encrypted.asc"')
         return msg
@@ -188,12 +304,57 @@ class GpgBackendBase(object):
         **kwargs
             Any additional parameters to the GPG backend.
         """
-        if isinstance(message, six.string_types):
+        from email.mime.text import MIMEText
+
+        if isinstance(message, str):
             message = MIMEText(message)
 
         msg = self.get_octet_stream(message, recipients, signer, **kwargs)
         return self.get_encrypted_message(msg)
 
+    def encrypt_messages(self, messages, recipients, signer=None, max_workers=None, **kwargs):
+        """Encrypt multiple messages in parallel.
+
+        This function calls :py:func:`encrypt_message` for every message using a pool of threads.
+        Every thread uses its own GPG context, but note that gpg-agent serializes operations that
+        require a private key, so signing messages will not scale as well as encrypting them.
+
+        Parameters
+        ----------
+
+        messages : list of MIMEBase or str
+            Messages to encrypt.
+        recipients : list of key ids
+            List of key ids to encrypt to.
+        signer : str
+            Key id to sign the messages with.
+        max_workers : int, optional
+            Maximum number of threads to use. The default is the number of CPUs, but at most
+            :py:data:`ENCRYPT_MESSAGES_MAX_WORKERS`.
+        **kwargs
+            Any additional parameters to the GPG backend.
+
+        Returns
+        -------
+
+        messages : list of MIMEMultipart
+            The encrypted messages, in the same order as ``messages``.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if max_workers is None:
+            max_workers = min(os.cpu_count() or 1, ENCRYPT_MESSAGES_MAX_WORKERS)
+
+        def encrypt(message):
+            # Worker threads are discarded with the executor, so return their contexts right away
+            try:
+                return self.encrypt_message(message, recipients, signer=signer, **kwargs)
+            finally:
+                self.close()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(encrypt, messages))
+
     ###########
     # Signing #
     ###########
@@ -207,6 +368,8 @@ class GpgBackendBase(object):
         signature : bytes
             A gpg signature.
         """
+        from email.mime.base import MIMEBase
+
         msg = MIMEBase(_maintype='application', _subtype='pgp-signature', name='signature.asc')
         msg.set_payload(signature)
         msg.add_header('Content-Description', 'OpenPGP digital signature')
@@ -226,6 +389,7 @@ class GpgBackendBase(object):
         signature : MIMEBase
             MIME message containing the signature.
         """
+        from email.mime.multipart import MIMEMultipart
 
         msg = MIMEMultipart(_subtype='signed', _subparts=[message, signature])
         msg.set_param('protocol', 'application/pgp-signature')
@@ -242,15 +406,18 @@ class GpgBackendBase(object):
             Key id to sign the message with.
         add_cr : bool, optional
             Wether or not to replace newlines (``\\n``) with carriage-return/newlines (``\\r\\n``).
-            E-Mail messages generally use ``\\r\\n``, so the default is True.
+            E-Mail messages generally use ``\\r\\n``, so the default is True. Newlines that are
+            already preceded by a carriage-return are left untouched.
         """
-        if isinstance(message, six.string_types):
+        from email.mime.text import MIMEText
+
+        if isinstance(message, str):
             message = MIMEText(message)
             del message['MIME-Version']
 
         data = message.as_bytes()
         if add_cr is True:
-            data = data.replace(b'\n', b'\r\n')
+            data = _normalize_crlf(data)
 
         # get the gpg signature
         signature = self.sign(data, signer)
@@ -286,6 +453,50 @@ class GpgBackendBase(object):
         """
         raise NotImplementedError
 
+    def sign_to(self, fp, data, signer):
+        """Sign passed data with the given keys and write the signature to a file-like object.
+
+        The default implementation reads all data into memory and calls :py:func:`sign`, backends
+        may override this method to stream data directly from and to the passed file-like objects.
+
+        Parameters
+        ----------
+
+        fp : file-like object
+            A file-like object opened in binary mode that the signature is written to.
+        data : bytes or file-like object
+            The data to sign.
+        signer : str
+            Key id to sign the message with.
+        """
+        if not isinstance(data, bytes):
+            data = data.read()
+        fp.write(self.sign(data, signer))
+
+    def encrypt_to(self, fp, data, recipients, **kwargs):
+        """Encrypt passed data with the given keys and write the result to a file-like object.
+
+        The default implementation reads all data into memory and calls :py:func:`encrypt`,
+        backends may override this method to stream data directly from and to the passed
+        file-like objects.
+
+        Parameters
+        ----------
+
+        fp : file-like object
+            A file-like object opened in binary mode that the encrypted data is written to.
+        data : bytes or file-like object
+            The data to encrypt.
+        recipients : list of str
+            A list of full GPG fingerprints (without a ``"0x"`` prefix) to encrypt the message to.
+        always_trust : bool, optional
+            If ``True``, always trust all keys, if ``False`` is passed, do not. The default value
+            is what is passed to the constructor as ``default_trust``.
+        """
+        if not isinstance(data, bytes):
+            data = data.read()
+        fp.write(self.encrypt(data, recipients, **kwargs))
+
     def sign_encrypt(self, data, recipients, signer, **kwargs):
         """Sign and encrypt passed data with the given keys.
 
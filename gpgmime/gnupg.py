@@ -15,6 +15,7 @@
 
 from __future__ import unicode_literals, absolute_import
 
+import io
 import os
 import tempfile
 
@@ -22,7 +23,6 @@ from datetime import datetime
 from threading import local
 
 import gnupg
-import six
 
 from .base import GpgBackendBase
 from .base import GpgKeyNotFoundError
@@ -159,7 +159,7 @@ class GnuPGBackend(GpgBackendBase):
         line = '%s:%s\n' % (fingerprint, trust)
         line = line.encode('utf-8')
 
-        self.gpg._handle_io(['--import-ownertrust'], six.BytesIO(line), result, binary=True)
+        self.gpg._handle_io(['--import-ownertrust'], io.BytesIO(line), result, binary=True)
 
     def get_trust(self, fingerprint, **kwargs):
         trust = self.gpg.list_keys(keys=fingerprint)[0]['ownertrust']
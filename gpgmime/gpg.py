@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of gpg-mime (https://github.com/mathiasertl/gpg-mime).
+#
+# gpg-mime is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# gpg-mime is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with gpg-mime. If
+# not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals, absolute_import
+
+import io
+import os
+
+from datetime import datetime
+from threading import local
+
+import gpg
+
+from .base import GpgBackendBase
+from .base import GpgKeyNotFoundError
+from .base import GpgUntrustedKeyError
+from .base import VALIDITY_UNKNOWN
+from .base import VALIDITY_NEVER
+from .base import VALIDITY_MARGINAL
+from .base import VALIDITY_FULL
+from .base import VALIDITY_ULTIMATE
+
+# Map our trust constants to the values expected by the "trust" command of "gpg --edit-key".
+# VALIDITY_UNKNOWN is deliberately missing, as the owner trust of a key cannot be reset to
+# "unknown".
+_trust_to_gpg = {
+    VALIDITY_NEVER: '2',
+    VALIDITY_MARGINAL: '3',
+    VALIDITY_FULL: '4',
+    VALIDITY_ULTIMATE: '5',
+}
+_gpg_to_trust = {
+    gpg.constants.validity.UNKNOWN: VALIDITY_UNKNOWN,
+    gpg.constants.validity.NEVER: VALIDITY_NEVER,
+    gpg.constants.validity.MARGINAL: VALIDITY_MARGINAL,
+    gpg.constants.validity.FULL: VALIDITY_FULL,
+    gpg.constants.validity.ULTIMATE: VALIDITY_ULTIMATE,
+}
+
+
+def _sync_fileno(fp):
+    """Move the file descriptor of ``fp`` to the position of the (possibly buffered) file object.
+
+    Returns ``False`` if ``fp`` is not a plain binary file or is not seekable, in which case it
+    must not be handed to GPGME directly. Wrappers like :py:class:`gzip.GzipFile` also have a
+    ``fileno()``, but the descriptor belongs to the compressed file underneath.
+    """
+    if not isinstance(fp, io.FileIO) and not isinstance(getattr(fp, 'raw', None), io.FileIO):
+        return False
+
+    try:
+        fp.flush()
+        os.lseek(fp.fileno(), fp.tell(), os.SEEK_SET)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return False
+    return True
+
+
+class GpgBackend(GpgBackendBase):
+    """A backend using the official `GnuPG Python bindings <https://pypi.python.org/pypi/gpg/>`_.
+
+    All ``kwargs`` for the constructor are passed to :py:class:`~gpgmime.base.GpgBackendBase`.
+
+    The bindings are distributed with `GPGME <https://www.gnupg.org/related_software/gpgme/>`_
+    itself and are usually installed with your distributions package (e.g. ``python3-gpg`` on
+    Debian/Ubuntu), but you can also install them with pip (this requires the GPGME headers)::
+
+        pip install gpg
+
+    Unlike :py:class:`~gpgmime.gpgme.GpgMeBackend`, this backend hands regular binary files
+    (as returned by ``open(..., 'rb')``) directly to GPGME, so
+    :py:func:`~gpgmime.base.GpgBackendBase.sign_to` and
+    :py:func:`~gpgmime.base.GpgBackendBase.encrypt_to` do not copy any data through Python.
+    """
+
+    def __init__(self, **kwargs):
+        super(GpgBackend, self).__init__(**kwargs)
+        self._local = local()
+
+    @property
+    def context(self):
+        if hasattr(self._local, 'context') is False:
+            context = gpg.Context(armor=True, home_dir=self._home)
+
+            if self._path:
+                context.set_engine_info(gpg.constants.protocol.OpenPGP, file_name=self._path,
+                                        home_dir=self._home)
+            self._local.context = context
+
+        return self._local.context
+
+    def close(self):
+        if hasattr(self._local, 'context'):
+            del self._local.context
+
+    def _get_key(self, fingerprint):
+        try:
+            return self.context.get_key(fingerprint.upper())
+        except gpg.errors.KeyNotFound:
+            raise GpgKeyNotFoundError("%s: key not found." % fingerprint)
+
+    def _get_input(self, data):
+        # GPGME reads bytes and plain files directly. Buffered file objects may have read ahead,
+        # so the descriptor has to be moved to the logical position first.
+        if isinstance(data, bytes) or _sync_fileno(data):
+            return data
+        return data.read()
+
+    def sign(self, data, signer):
+        self.context.signers = [self._get_key(signer)]
+        try:
+            signature, result = self.context.sign(data, mode=gpg.constants.sig.mode.DETACH)
+        finally:
+            self.context.signers = []
+        return signature
+
+    def sign_to(self, fp, data, signer):
+        if not _sync_fileno(fp):
+            return super(GpgBackend, self).sign_to(fp, data, signer)
+
+        data = self._get_input(data)
+
+        self.context.signers = [self._get_key(signer)]
+        try:
+            self.context.op_sign(data, fp, gpg.constants.sig.mode.DETACH)
+        finally:
+            self.context.signers = []
+
+    def _encrypt(self, data, recipients, always_trust, sign=False, sink=None):
+        recipients = [self._get_key(k) for k in recipients]
+
+        try:
+            encrypted, result, sign_result = self.context.encrypt(
+                data, recipients=recipients, sign=sign, sink=sink, always_trust=always_trust)
+        except gpg.errors.InvalidRecipients:
+            raise GpgUntrustedKeyError("Key not trusted.")
+        return encrypted
+
+    def encrypt(self, data, recipients, **kwargs):
+        always_trust = kwargs.get('always_trust', self._default_trust)
+        return self._encrypt(data, recipients, always_trust)
+
+    def encrypt_to(self, fp, data, recipients, **kwargs):
+        if not _sync_fileno(fp):
+            return super(GpgBackend, self).encrypt_to(fp, data, recipients, **kwargs)
+
+        always_trust = kwargs.get('always_trust', self._default_trust)
+        data = self._get_input(data)
+        self._encrypt(data, recipients, always_trust, sink=fp)
+
+    def sign_encrypt(self, data, recipients, signer, **kwargs):
+        always_trust = kwargs.get('always_trust', self._default_trust)
+        self.context.signers = [self._get_key(signer)]
+        try:
+            return self._encrypt(data, recipients, always_trust, sign=True)
+        finally:
+            self.context.signers = []
+
+    def verify(self, data, signature):
+        try:
+            data, result = self.context.verify(data, signature=signature)
+        except gpg.errors.BadSignatures:
+            return None
+        return result.signatures[0].fpr
+
+    def decrypt(self, data, **kwargs):
+        decrypted, result, verify_result = self.context.decrypt(data, verify=False)
+        return decrypted
+
+    def decrypt_verify(self, data, **kwargs):
+        try:
+            decrypted, result, verify_result = self.context.decrypt(data)
+        except gpg.errors.BadSignatures:
+            return None
+        return decrypted, verify_result.signatures[0].fpr
+
+    def import_key(self, data, **kwargs):
+        try:
+            self.context.op_import(data)
+        except gpg.errors.GPGMEError as e:
+            if e.getcode() == gpg.errors.NO_DATA:
+                return []
+            raise
+
+        result = self.context.op_import_result()
+        if result is None:
+            return []
+        return [i.fpr for i in result.imports]
+
+    def import_private_key(self, data, **kwargs):
+        return self.import_key(data, **kwargs)
+
+    def set_trust(self, fingerprint, trust, **kwargs):
+        key = self._get_key(fingerprint)
+
+        try:
+            value = _trust_to_gpg[trust]
+        except (KeyError, TypeError):
+            raise ValueError("Unknown trust passed.")
+
+        commands = ['trust', 'quit']
+
+        def edit(status, args):
+            if status == 'GET_LINE' and args == 'keyedit.prompt':
+                return commands.pop(0)
+            elif status == 'GET_LINE' and args == 'edit_ownertrust.value':
+                return value
+            elif status == 'GET_BOOL' and args in ['edit_ownertrust.set_ultimate.okay',
+                                                   'keyedit.save.okay']:
+                return 'Y'
+
+        self.context.interact(key, edit)
+
+    def get_trust(self, fingerprint, **kwargs):
+        key = self._get_key(fingerprint)
+        return _gpg_to_trust.get(key.owner_trust, VALIDITY_UNKNOWN)
+
+    def expires(self, fingerprint, **kwargs):
+        key = self._get_key(fingerprint)
+        expires = lambda i: datetime.fromtimestamp(i) if i else None
+        subkeys = {sk.fpr: expires(sk.expires) for sk in key.subkeys}
+        return subkeys[fingerprint]
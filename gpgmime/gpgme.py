@@ -15,12 +15,19 @@
 
 from __future__ import unicode_literals, absolute_import
 
+import io
+import time
+
+from collections import OrderedDict
 from datetime import datetime
+from queue import Empty
+from queue import Full
+from queue import LifoQueue
+from threading import Lock
 from threading import local
 
 import gpgme
 import gpgme.editutil
-import six
 
 from .base import GpgBackendBase
 from .base import GpgUntrustedKeyError
@@ -31,6 +38,65 @@ from .base import VALIDITY_MARGINAL
 from .base import VALIDITY_FULL
 from .base import VALIDITY_ULTIMATE
 
+#: Number of seconds keys looked up in the keyring are cached.
+KEYRING_CACHE_TIMEOUT = 60
+
+#: Maximum number of distinct lists of recipients with resolved keys cached per GPG home directory
+#: and binary.
+RECIPIENTS_CACHE_SIZE = 128
+
+#: Maximum number of idle contexts kept for reuse per GPG home directory and binary.
+CONTEXT_POOL_SIZE = 8
+
+#: Maximum number of GPG home directory and binary combinations that contexts and keys are cached
+#: for.
+CACHED_HOMES = 16
+
+# Map our trust constants to gpgme validity values. VALIDITY_UNKNOWN is deliberately missing, as
+# the owner trust of a key cannot be reset to "unknown".
+_trust_to_gpgme = {
+    VALIDITY_NEVER: gpgme.VALIDITY_NEVER,
+    VALIDITY_MARGINAL: gpgme.VALIDITY_MARGINAL,
+    VALIDITY_FULL: gpgme.VALIDITY_FULL,
+    VALIDITY_ULTIMATE: gpgme.VALIDITY_ULTIMATE,
+}
+_gpgme_to_trust = {v: k for k, v in _trust_to_gpgme.items()}
+
+# Context attributes that callers may modify and that are restored before a context is reused
+_context_attrs = ('armor', 'textmode', 'include_certs', 'keylist_mode', 'protocol',
+                  'passphrase_cb', 'progress_cb', 'signers')
+
+# Idle contexts that can be used by any backend instance, by (home, path). The pools hold tuples
+# of a context and the initial values of its attributes.
+_context_pools = OrderedDict()
+
+# Keys and lists of resolved recipient keys shared by all backend instances, by (home, path). The
+# caches map fingerprints (or tuples of recipients) to tuples of (timestamp, key(s)).
+_key_caches = OrderedDict()
+
+_cache_lock = Lock()
+
+
+def _get_cached(caches, home, path, factory):
+    """Get the cache for the given home and path, dropping least recently used ones."""
+    with _cache_lock:
+        cache = caches.get((home, path))
+        if cache is None:
+            cache = caches[(home, path)] = factory()
+            while len(caches) > CACHED_HOMES:
+                caches.popitem(last=False)
+        else:
+            caches.move_to_end((home, path))
+    return cache
+
+
+def _get_context_pool(home, path):
+    return _get_cached(_context_pools, home, path, lambda: LifoQueue(maxsize=CONTEXT_POOL_SIZE))
+
+
+def _get_key_cache(home, path):
+    return _get_cached(_key_caches, home, path, lambda: {'keys': {}, 'recipients': {}})
+
 
 class GpgMeBackend(GpgBackendBase):
     """A backend using `pygpgme <https://pypi.python.org/pypi/pygpgme/>`_.
@@ -44,6 +110,9 @@ class GpgMeBackend(GpgBackendBase):
     Note that there is also `unofficial (and incomplete) documentation
     <https://pygpgme.readthedocs.io/en/latest/api.html>`_ for pygpgme.
 
+    In addition to fingerprints, the ``recipients`` passed to any encryption function may also
+    contain ``gpgme.Key`` instances.
+
     Parameters
     ----------
 
@@ -58,136 +127,219 @@ class GpgMeBackend(GpgBackendBase):
     @property
     def context(self):
         if hasattr(self._local, 'context') is False:
-            context = gpgme.Context()
-            context.armor = True
-
-            if self._path or self._home:
-                context.set_engine_info(gpgme.PROTOCOL_OpenPGP, self._path, self._home)
+            try:
+                context, defaults = _get_context_pool(self._home, self._path).get_nowait()
+            except Empty:
+                context = gpgme.Context()
+                context.armor = True
+
+                if self._path or self._home:
+                    context.set_engine_info(gpgme.PROTOCOL_OpenPGP, self._path, self._home)
+                defaults = {name: getattr(context, name) for name in _context_attrs
+                            if hasattr(context, name)}
             self._local.context = context
+            self._local.context_defaults = defaults
 
         return self._local.context
 
-    def _get_key(self, fingerprint):
+    def close(self):
+        """Return the context used in the current thread to the context pool.
+
+        Contexts in the pool are shared by all instances using the same ``home`` and ``path``, so
+        short-lived backends (e.g. created by :py:func:`~gpgmime.base.GpgBackendBase.settings`)
+        do not have to initialize a new context every time. Any attributes modified on the
+        context are reset before it is returned to the pool.
+        """
+        context = getattr(self._local, 'context', None)
+        if context is None:
+            return
+
+        defaults = self._local.context_defaults
+        del self._local.context
+        del self._local.context_defaults
+
         try:
-            return self.context.get_key(fingerprint.upper())
+            for name, value in defaults.items():
+                setattr(context, name, value)
+            context.set_engine_info(gpgme.PROTOCOL_OpenPGP, self._path, self._home)
+        except (gpgme.GpgmeError, AttributeError, TypeError, ValueError):
+            return  # do not reuse a context that could not be reset
+
+        try:
+            _get_context_pool(self._home, self._path).put_nowait((context, defaults))
+        except Full:
+            pass
+
+    def _get_key(self, fingerprint, cached=True):
+        keys = _get_key_cache(self._home, self._path)['keys']
+        fpr = fingerprint.upper()
+        now = time.time()
+
+        if cached is True:
+            entry = keys.get(fpr)
+            if entry is not None and entry[0] > now - KEYRING_CACHE_TIMEOUT:
+                return entry[1]
+
+        try:
+            key = self.context.get_key(fpr)
         except gpgme.GpgmeError as e:
             if e.source == gpgme.ERR_SOURCE_GPGME and e.code == gpgme.ERR_EOF:
                 raise GpgKeyNotFoundError("%s: key not found." % fingerprint)
             raise
 
+        keys[fpr] = (now, key)
+        return key
+
+    def _resolve_recipients(self, recipients):
+        """Get the keys for the passed list of recipients.
+
+        Recipients may be fingerprints or already resolved ``gpgme.Key`` instances. The result is
+        cached, so encrypting to the same list of recipients again is cheap.
+        """
+        cache = _get_key_cache(self._home, self._path)['recipients']
+        cache_key = tuple(recipients)
+        now = time.time()
+
+        entry = cache.get(cache_key)
+        if entry is not None and entry[0] > now - KEYRING_CACHE_TIMEOUT:
+            return entry[1]
+
+        keys = [k if isinstance(k, gpgme.Key) else self._get_key(k) for k in cache_key]
+        if len(cache) >= RECIPIENTS_CACHE_SIZE:
+            cache.clear()
+        cache[cache_key] = (now, keys)
+        return keys
+
+    def _clear_key_cache(self):
+        """Clear the keys cached by :py:func:`_get_key` and :py:func:`_resolve_recipients`.
+
+        The cache is shared by all instances using the same ``home`` and ``path``, so this clears
+        it for all of them. This must be called whenever keys in the keyring are modified.
+        """
+        cache = _get_key_cache(self._home, self._path)
+        cache['keys'].clear()
+        cache['recipients'].clear()
+
     def _encrypt_flags(self, always_trust=True, **kwargs):
         flags = 0
         if always_trust is True:
             flags |= gpgme.ENCRYPT_ALWAYS_TRUST
         return flags
 
-    def _encrypt(self, data, recipients, always_trust):
-        recipients = [self._get_key(k) for k in recipients]
+    def _encrypt_stream(self, data_fp, out_fp, recipients, always_trust):
+        recipients = self._resolve_recipients(recipients)
 
-        output_bytes = six.BytesIO()
         flags = self._encrypt_flags(always_trust=always_trust)
         try:
-            if self.context.signers:
-                self.context.encrypt_sign(recipients, flags, six.BytesIO(data), output_bytes)
-            else:
-                self.context.encrypt(recipients, flags, six.BytesIO(data), output_bytes)
+            self.context.encrypt(recipients, flags, data_fp, out_fp)
         except gpgme.GpgmeError as e:
             if e.source == gpgme.ERR_SOURCE_UNKNOWN and e.code == gpgme.ERR_GENERAL:
                 raise GpgUntrustedKeyError("Key not trusted.")
 
             raise
 
-        output_bytes.seek(0)
+    def _encrypt(self, data, recipients, always_trust):
+        output_bytes = io.BytesIO()
+        self._encrypt_stream(io.BytesIO(data), output_bytes, recipients, always_trust)
         return output_bytes.getvalue()
 
-    def sign(self, data, signer):
+    def _sign_stream(self, data_fp, out_fp, signer):
         signer = self._get_key(signer)
-        output_bytes = six.BytesIO()
 
         self.context.signers = [signer]
         try:
-            self.context.sign(six.BytesIO(data), output_bytes, gpgme.SIG_MODE_DETACH)
+            self.context.sign(data_fp, out_fp, gpgme.SIG_MODE_DETACH)
         finally:
             self.context.signers = []
-        output_bytes.seek(0)
+
+    def sign(self, data, signer):
+        output_bytes = io.BytesIO()
+        self._sign_stream(io.BytesIO(data), output_bytes, signer)
         return output_bytes.getvalue()
 
+    def sign_to(self, fp, data, signer):
+        if isinstance(data, bytes):
+            data = io.BytesIO(data)
+        self._sign_stream(data, fp, signer)
+
     def encrypt(self, data, recipients, **kwargs):
         always_trust = kwargs.get('always_trust', self._default_trust)
         return self._encrypt(data, recipients, always_trust)
 
+    def encrypt_to(self, fp, data, recipients, **kwargs):
+        always_trust = kwargs.get('always_trust', self._default_trust)
+        if isinstance(data, bytes):
+            data = io.BytesIO(data)
+        self._encrypt_stream(data, fp, recipients, always_trust)
+
     def sign_encrypt(self, data, recipients, signer, **kwargs):
         always_trust = kwargs.get('always_trust', self._default_trust)
+        flags = self._encrypt_flags(always_trust=always_trust)
         signer = self._get_key(signer)
-        self.context.signers = [signer]
+        recipients = self._resolve_recipients(recipients)
 
+        context = self.context
+        output_bytes = io.BytesIO()
+        context.signers = [signer]
         try:
-            return self._encrypt(data, recipients, always_trust)
+            context.encrypt_sign(recipients, flags, io.BytesIO(data), output_bytes)
+            return output_bytes.getvalue()
+        except gpgme.GpgmeError as e:
+            if e.source == gpgme.ERR_SOURCE_UNKNOWN and e.code == gpgme.ERR_GENERAL:
+                raise GpgUntrustedKeyError("Key not trusted.")
+
+            raise
         finally:
-            self.context.signers = []
+            context.signers = []
 
     def verify(self, data, signature):
-        signatures = self.context.verify(six.BytesIO(signature), six.BytesIO(data), None)
+        signatures = self.context.verify(io.BytesIO(signature), io.BytesIO(data), None)
 
-        errors = list(filter(lambda s: s.status is not None, signatures))
-        if not errors:
+        if not any(s.status is not None for s in signatures):
             return signatures[0].fpr
 
     def decrypt(self, data, **kwargs):
-        output = six.BytesIO()
-        self.context.decrypt(six.BytesIO(data), output)
+        output = io.BytesIO()
+        self.context.decrypt(io.BytesIO(data), output)
         return output.getvalue()
 
     def decrypt_verify(self, data, **kwargs):
-        output = six.BytesIO()
-        signatures = self.context.decrypt_verify(six.BytesIO(data), output)
+        output = io.BytesIO()
+        signatures = self.context.decrypt_verify(io.BytesIO(data), output)
 
-        errors = list(filter(lambda s: s.status is not None, signatures))
-        if not errors:
+        if not any(s.status is not None for s in signatures):
             return output.getvalue(), signatures[0].fpr
 
     def import_key(self, data, **kwargs):
-        result = self.context.import_(six.BytesIO(data))
+        result = self.context.import_(io.BytesIO(data))
+        self._clear_key_cache()
         return [r[0] for r in result.imports]
 
     def import_private_key(self, data, **kwargs):
-        result = self.context.import_(six.BytesIO(data))
+        result = self.context.import_(io.BytesIO(data))
+        self._clear_key_cache()
         return [r[0] for r in result.imports]
 
     def set_trust(self, fingerprint, trust, **kwargs):
-        key = self._get_key(fingerprint)
-
-        if trust == VALIDITY_NEVER:
-            trust = gpgme.VALIDITY_NEVER
-        elif trust == VALIDITY_MARGINAL:
-            trust = gpgme.VALIDITY_MARGINAL
-        elif trust == VALIDITY_FULL:
-            trust = gpgme.VALIDITY_FULL
-        elif trust == VALIDITY_ULTIMATE:
-            trust = gpgme.VALIDITY_ULTIMATE
-        else:
+        key = self._get_key(fingerprint, cached=False)
+
+        try:
+            trust = _trust_to_gpgme[trust]
+        except (KeyError, TypeError):
             raise ValueError("Unknown trust passed.")
 
-        gpgme.editutil.edit_trust(self.context, key, trust)
+        try:
+            gpgme.editutil.edit_trust(self.context, key, trust)
+        finally:
+            self._clear_key_cache()
 
     def get_trust(self, fingerprint, **kwargs):
-        key = self._get_key(fingerprint)
-
-        if key.owner_trust == gpgme.VALIDITY_UNKNOWN:
-            return VALIDITY_UNKNOWN
-        elif key.owner_trust == gpgme.VALIDITY_NEVER:
-            return VALIDITY_NEVER
-        elif key.owner_trust == gpgme.VALIDITY_MARGINAL:
-            return VALIDITY_MARGINAL
-        elif key.owner_trust == gpgme.VALIDITY_FULL:
-            return VALIDITY_FULL
-        elif key.owner_trust == gpgme.VALIDITY_ULTIMATE:
-            return VALIDITY_ULTIMATE
-        else:
-            return VALIDITY_UNKNOWN
+        key = self._get_key(fingerprint, cached=False)
+
+        return _gpgme_to_trust.get(key.owner_trust, VALIDITY_UNKNOWN)
 
     def expires(self, fingerprint, **kwargs):
-        key = self._get_key(fingerprint)
+        key = self._get_key(fingerprint, cached=False)
         expires = lambda i: datetime.fromtimestamp(i) if i else None
         subkeys = {sk.fpr: expires(sk.expires) for sk in key.subkeys}
         return subkeys[fingerprint]
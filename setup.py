@@ -77,8 +77,18 @@ class BackendMailCommand(Command):
         finally:
             shutil.rmtree(tmpdir)
 
+    def test_gpg(self):
+        tmpdir = tempfile.mkdtemp()
+
+        try:
+            from gpgmime import gpg
+            self.test_backend(gpg.GpgBackend(home=tmpdir))
+        finally:
+            shutil.rmtree(tmpdir)
+
     def run(self):
         self.test_gpgme()
+        self.test_gpg()
 
 
 setup(
@@ -102,8 +112,6 @@ setup(
         'Intended Audience :: Developers',
         'Intended Audience :: System Administrators',
         'License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
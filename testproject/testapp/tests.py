@@ -15,24 +15,41 @@
 
 from __future__ import unicode_literals, absolute_import
 
+import gzip
+import io
 import os
 import shutil
 import tempfile
+import unittest
 
+from collections import OrderedDict
 from datetime import datetime
+from email import message_from_bytes
+from unittest import mock
+from urllib.parse import urlencode
 
 from django.test import TestCase
 
+from gpgmime.base import KEY_CACHE_TIMEOUT
 from gpgmime.base import VALIDITY_FULL
 from gpgmime.base import VALIDITY_MARGINAL
 from gpgmime.base import VALIDITY_NEVER
 from gpgmime.base import VALIDITY_ULTIMATE
 from gpgmime.base import VALIDITY_UNKNOWN
+from gpgmime.base import GpgBackendBase
 from gpgmime.base import GpgKeyNotFoundError
+from gpgmime.base import GpgMimeError
 from gpgmime.base import GpgUntrustedKeyError
+from gpgmime.base import _key_cache
+from gpgmime.base import _normalize_crlf
 from gpgmime.gpgme import GpgMeBackend
 from gpgmime.gnupg import GnuPGBackend
 
+try:
+    from gpgmime.gpg import GpgBackend
+except ImportError:  # the official gpg bindings are optional
+    GpgBackend = None
+
 basedir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 testdatadir = os.path.join(basedir, 'testdata')
 
@@ -118,6 +135,16 @@ class TestCaseMixin(object):
         signature = self.backend.sign(data, user3_fp)
         self.assertEqual(self.backend.verify(data, signature), user3_fp)
 
+    def test_sign_to(self):
+        data = b'testdata'
+
+        self.assertEqual(self.backend.import_key(user3_pub), [user3_fp])
+        self.assertEqual(self.backend.import_private_key(user3_priv), [user3_fp, user3_fp])
+
+        stream = io.BytesIO()
+        self.backend.sign_to(stream, io.BytesIO(data), user3_fp)
+        self.assertEqual(self.backend.verify(data, stream.getvalue()), user3_fp)
+
     def test_sign_unknown_key(self):
         with self.assertRaises(GpgKeyNotFoundError):
             self.backend.sign(b'testdata', user3_fp)
@@ -130,6 +157,15 @@ class TestCaseMixin(object):
         encrypted = self.backend.encrypt(data, [user1_fp], always_trust=True)
         self.assertEqual(self.backend.decrypt(encrypted), data)
 
+    def test_encrypt_to(self):
+        data = b'testdata'
+        self.assertEqual(self.backend.import_key(user1_pub), [user1_fp])
+        self.assertEqual(self.backend.import_private_key(user1_priv), [user1_fp, user1_fp])
+
+        stream = io.BytesIO()
+        self.backend.encrypt_to(stream, io.BytesIO(data), [user1_fp], always_trust=True)
+        self.assertEqual(self.backend.decrypt(stream.getvalue()), data)
+
     def test_encrypt_unkown_key(self):
         with self.assertRaises(GpgKeyNotFoundError):
             self.backend.encrypt(b'foobar', [user1_fp], always_trust=True)
@@ -137,6 +173,20 @@ class TestCaseMixin(object):
         with self.assertRaises(GpgKeyNotFoundError):
             self.backend.encrypt(b'foobar', [user1_fp])
 
+    def test_encrypt_messages(self):
+        self.assertEqual(self.backend.import_key(user1_pub), [user1_fp])
+        self.assertEqual(self.backend.import_private_key(user1_priv), [user1_fp, user1_fp])
+
+        data = ['message %s' % i for i in range(8)]
+        messages = self.backend.encrypt_messages(data, [user1_fp], always_trust=True)
+        self.assertEqual(len(messages), len(data))
+        for text, message in zip(data, messages):
+            self.assertEqual(message.get_content_type(), 'multipart/encrypted')
+
+            encrypted = message.get_payload()[1].get_payload(decode=True)
+            decrypted = message_from_bytes(self.backend.decrypt(encrypted))
+            self.assertEqual(decrypted.get_payload(), text)
+
     def test_sign_encrypt(self):
         data = b'testdata'
         self.assertEqual(self.backend.import_key(user3_pub), [user3_fp])
@@ -165,6 +215,14 @@ class TestCaseMixin(object):
             self.backend.set_trust(user4_fp, trust)
             self.assertEqual(self.backend.get_trust(user4_fp), trust)
 
+    def test_settings_trust(self):
+        self.assertEqual(self.backend.import_key(user4_pub), [user4_fp])
+        self.assertEqual(self.backend.get_trust(user4_fp), VALIDITY_UNKNOWN)
+
+        with self.backend.settings() as backend:
+            backend.set_trust(user4_fp, VALIDITY_FULL)
+        self.assertEqual(self.backend.get_trust(user4_fp), VALIDITY_FULL)
+
     def test_set_unknown_trust(self):
         self.assertEqual(self.backend.import_key(user4_pub), [user4_fp])
         self.assertEqual(self.backend.get_trust(user4_fp), VALIDITY_UNKNOWN)
@@ -226,6 +284,11 @@ class TestCaseMixin(object):
             with self.assertRaises(GpgUntrustedKeyError):
                 self.backend.encrypt(data, [user1_fp], always_trust=False)
 
+    def test_close(self):
+        self.assertEqual(self.backend.import_key(user1_pub), [user1_fp])
+        self.backend.close()
+        self.assertIsNone(self.backend.expires(user1_fp))
+
     def __exit__(self, *args, **kwargs):
         print(args, kwargs)
 
@@ -241,8 +304,204 @@ class GpgMeTestCase(TestCaseMixin, TestCase):
         super(GpgMeTestCase, self).setUp()
         self.backend = GpgMeBackend(home=self.home)
 
+    def test_context_pool(self):
+        context = self.backend.context
+        self.backend.close()
+
+        backend = GpgMeBackend(home=self.home)
+        self.assertIs(backend.context, context)
+        backend.close()
+
+    def test_resolve_recipients_generator(self):
+        self.assertEqual(self.backend.import_key(user1_pub), [user1_fp])
+        self.assertEqual(self.backend.import_key(user2_pub), [user2_fp])
+
+        for i in range(2):
+            keys = self.backend._resolve_recipients(fp for fp in [user1_fp, user2_fp])
+            self.assertEqual([k.subkeys[0].fpr for k in keys], [user1_fp, user2_fp])
+
+        keys = self.backend._resolve_recipients([user1_fp, user2_fp])
+        self.assertEqual([k.subkeys[0].fpr for k in keys], [user1_fp, user2_fp])
+
+    def test_context_pool_reset(self):
+        self.backend.context.armor = False
+        self.backend.context.passphrase_cb = lambda *args: None
+        self.backend.close()
+
+        backend = GpgMeBackend(home=self.home)
+        self.assertTrue(backend.context.armor)
+        self.assertIsNone(backend.context.passphrase_cb)
+        backend.close()
+
+
+@unittest.skipIf(GpgBackend is None, 'gpg bindings are not installed.')
+class GpgTestCase(TestCaseMixin, TestCase):
+    def setUp(self):
+        super(GpgTestCase, self).setUp()
+        self.backend = GpgBackend(home=self.home)
+
+    def test_encrypt_to_file(self):
+        data = b'testdata'
+        self.assertEqual(self.backend.import_key(user1_pub), [user1_fp])
+        self.assertEqual(self.backend.import_private_key(user1_priv), [user1_fp, user1_fp])
+
+        with tempfile.TemporaryFile() as stream:
+            self.backend.encrypt_to(stream, data, [user1_fp], always_trust=True)
+            stream.seek(0)
+            self.assertEqual(self.backend.decrypt(stream.read()), data)
+
+    def test_sign_buffered_file(self):
+        self.assertEqual(self.backend.import_private_key(user1_priv), [user1_fp, user1_fp])
+
+        with tempfile.TemporaryFile() as stream:
+            stream.write(b'header\ntestdata')
+            stream.seek(0)
+            stream.readline()  # the buffered reader has already read ahead past this line
+
+            output = io.BytesIO()
+            self.backend.sign_to(output, stream, user1_fp)
+            self.assertEqual(self.backend.verify(b'testdata', output.getvalue()), user1_fp)
+
+    def test_encrypt_to_gzip(self):
+        data = b'testdata'
+        self.assertEqual(self.backend.import_key(user1_pub), [user1_fp])
+        self.assertEqual(self.backend.import_private_key(user1_priv), [user1_fp, user1_fp])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'data.gz')
+            dest = os.path.join(tmpdir, 'encrypted.gz')
+            with gzip.open(source, 'wb') as stream:
+                stream.write(data)
+
+            # data is read from and written to the uncompressed stream, not the file underneath
+            with gzip.open(source, 'rb') as stream_in, gzip.open(dest, 'wb') as stream_out:
+                self.backend.encrypt_to(stream_out, stream_in, [user1_fp], always_trust=True)
+                self.assertEqual(stream_in.read(), b'')
+
+            with gzip.open(dest, 'rb') as stream:
+                self.assertEqual(self.backend.decrypt(stream.read()), data)
+
 
 class GnuPGTestCase(TestCaseMixin, TestCase):
     def setUp(self):
         super(GnuPGTestCase, self).setUp()
         self.backend = GnuPGBackend(home=self.home)
+
+
+class NormalizeCrlfTestCase(TestCase):
+    def test_normalize_crlf(self):
+        self.assertEqual(_normalize_crlf(b'foo\nbar\n'), b'foo\r\nbar\r\n')
+        self.assertEqual(_normalize_crlf(b'foo\r\nbar\n'), b'foo\r\nbar\r\n')
+        self.assertEqual(_normalize_crlf(b'foo\r\n\r\n'), b'foo\r\n\r\n')
+        self.assertEqual(_normalize_crlf(b'foo\rbar'), b'foo\rbar')
+        self.assertEqual(_normalize_crlf(b''), b'')
+
+
+class FetchKeyTestCase(TestCase):
+    keyserver = 'http://keys.example.com'
+
+    def setUp(self):
+        self.backend = GpgBackendBase()
+        _key_cache.clear()
+
+    def tearDown(self):
+        _key_cache.clear()
+
+    def urlopen(self, response):
+        return mock.patch('urllib.request.urlopen',
+                          side_effect=lambda url, **kwargs: io.BytesIO(response))
+
+    def fetch(self, search, **kwargs):
+        return self.backend.fetch_key(search, keyserver=self.keyserver, **kwargs)
+
+    def test_cache(self):
+        with self.urlopen(b' key\n') as urlopen:
+            self.assertEqual(self.fetch('0x1'), b'key')
+            self.assertEqual(self.fetch('0x1'), b'key')
+        self.assertEqual(urlopen.call_count, 1)
+
+        # keyserver is part of the cache key
+        with self.urlopen(b'key') as urlopen:
+            self.backend.fetch_key('0x1', keyserver='http://other.example.com')
+        self.assertEqual(urlopen.call_count, 1)
+
+    def test_cache_timeout(self):
+        with self.urlopen(b'key') as urlopen, mock.patch('time.time') as now:
+            now.return_value = 1000
+            self.fetch('0x1')
+            now.return_value = 1000 + KEY_CACHE_TIMEOUT - 1
+            self.fetch('0x1')
+            self.assertEqual(urlopen.call_count, 1)
+
+            now.return_value = 1000 + KEY_CACHE_TIMEOUT
+            self.fetch('0x1')
+            self.assertEqual(urlopen.call_count, 2)
+
+    def test_no_cache(self):
+        with self.urlopen(b'key') as urlopen:
+            self.fetch('0x1')
+            self.fetch('0x1', cache=False)
+            self.assertEqual(urlopen.call_count, 2)
+
+            # result was still stored in the cache
+            self.fetch('0x1')
+            self.assertEqual(urlopen.call_count, 2)
+
+    @mock.patch('gpgmime.base.KEY_CACHE_SIZE', 2)
+    def test_cache_size(self):
+        with self.urlopen(b'key') as urlopen:
+            self.fetch('0x1')
+            self.fetch('0x2')
+            self.fetch('0x1')  # cache hit, 0x2 is now least recently used
+            self.fetch('0x3')  # evicts 0x2
+            self.assertEqual(urlopen.call_count, 3)
+
+            self.fetch('0x1')
+            self.fetch('0x3')
+            self.assertEqual(urlopen.call_count, 3)
+
+            self.fetch('0x2')
+            self.assertEqual(urlopen.call_count, 4)
+
+    @mock.patch('gpgmime.base.KEY_MAX_SIZE', 4)
+    def test_max_size(self):
+        with self.urlopen(b'12345'):
+            with self.assertRaises(GpgMimeError):
+                self.fetch('0x1')
+        self.assertEqual(len(_key_cache), 0)
+
+        with self.urlopen(b'1234'):
+            self.assertEqual(self.fetch('0x1'), b'1234')
+
+    def test_url(self):
+        for search in ['0xCC9F343794DBB20E13DE097EE53338B91AA9A0AC', 'user name@example.com',
+                       'a/b&c=d+e%f', '\xfcser']:
+            params = OrderedDict([('search', search), ('options', 'mr'), ('op', 'get')])
+            with self.urlopen(b'key') as urlopen:
+                self.fetch(search)
+            urlopen.assert_called_once_with(
+                '%s/pks/lookup?%s' % (self.keyserver, urlencode(params)), timeout=3)
+
+    def test_fetch_keys(self):
+        def urlopen(url, **kwargs):
+            return io.BytesIO(b'key-' + url.split('search=')[1].split('&')[0].encode('utf-8'))
+
+        with mock.patch('urllib.request.urlopen', side_effect=urlopen) as mocked:
+            self.fetch('0x2')
+            mocked.reset_mock()
+
+            searches = ['0x1', '0x2', '0x3', '0x4']
+            keys = self.backend.fetch_keys(searches, keyserver=self.keyserver, timeout=10)
+            self.assertEqual(keys, [b'key-0x1', b'key-0x2', b'key-0x3', b'key-0x4'])
+
+            # 0x2 was served from the cache
+            self.assertEqual(sorted(c[0][0] for c in mocked.call_args_list), [
+                '%s/pks/lookup?search=%s&options=mr&op=get' % (self.keyserver, s)
+                for s in ['0x1', '0x3', '0x4']])
+            for call in mocked.call_args_list:
+                self.assertEqual(call[1], {'timeout': 10})
+
+            mocked.reset_mock()
+            keys = self.backend.fetch_keys(searches, keyserver=self.keyserver, cache=False)
+            self.assertEqual(keys, [b'key-0x1', b'key-0x2', b'key-0x3', b'key-0x4'])
+            self.assertEqual(mocked.call_count, 4)